@@ -1,58 +1,75 @@
-import json
-from pathlib import Path
+import threading
+import orjson
 from .logging import get_logger
+from .paths import CONFIG_FILE
 
 logger = get_logger(__name__)
 
-# --- Configuration ---
-try:
-    # Path to the top-level project folder
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-    CONFIG_FILE = PROJECT_ROOT / "app_config.json"
-except NameError:
-    # Fallback for different environments
-    PROJECT_ROOT = Path.cwd()
-    CONFIG_FILE = PROJECT_ROOT / "app_config.json"
-
 # --- Default Settings ---
 # These settings will be used if the config file doesn't exist yet.
 DEFAULT_CONFIG = {
     "scheduler": {
-        "interval_minutes": 60
+        "interval_minutes": 60,
+        # 1 re-reads the whole source every cycle; N > 1 runs N - 1 incremental cycles in between
+        "rebuild_every_n_cycles": 1
     },
     "etl": {
-        "chunk_size": 1000
+        "chunk_size": 1000,
+        "inter_chunk_sleep_s": 0
     }
 }
 
+# --- In-process cache of the parsed config, keyed on the file's mtime ---
+_config_lock = threading.Lock()
+_cached_config: dict | None = None
+_cached_mtime_ns: int | None = None
+
+def _write_config(config_data: dict):
+    """Writes the config file and refreshes the cache. Caller must hold _config_lock."""
+    global _cached_config, _cached_mtime_ns
+    try:
+        with open(CONFIG_FILE, 'wb') as f:
+            f.write(orjson.dumps(config_data, option=orjson.OPT_INDENT_2))
+        _cached_config = config_data
+        _cached_mtime_ns = CONFIG_FILE.stat().st_mtime_ns
+        logger.info(f"Successfully saved new configuration to {CONFIG_FILE}")
+    except IOError as e:
+        logger.error(f"Failed to save configuration file: {e}")
+
 def get_config() -> dict:
     """
     Reads the app_config.json file and returns its content.
     If the file doesn't exist, it creates it with default values.
+    The parsed config is cached and only re-read when the file's mtime changes, so
+    callers get a shared dict and must not modify it in place.
     """
-    if not CONFIG_FILE.is_file():
-        logger.warning(f"Configuration file not found at {CONFIG_FILE}. Creating a default one.")
-        save_config(DEFAULT_CONFIG)
-        return DEFAULT_CONFIG
+    global _cached_config, _cached_mtime_ns
+    with _config_lock:
+        try:
+            mtime_ns = CONFIG_FILE.stat().st_mtime_ns
+        except FileNotFoundError:
+            logger.warning(f"Configuration file not found at {CONFIG_FILE}. Creating a default one.")
+            _write_config(DEFAULT_CONFIG)
+            return DEFAULT_CONFIG
+
+        if _cached_config is not None and mtime_ns == _cached_mtime_ns:
+            return _cached_config
     
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            config_data = json.load(f)
-        return config_data
-    except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"Error reading config file: {e}. Returning default config as a fallback.")
-        return DEFAULT_CONFIG
+        try:
+            with open(CONFIG_FILE, 'rb') as f:
+                config_data = orjson.loads(f.read())
+            _cached_config, _cached_mtime_ns = config_data, mtime_ns
+            return config_data
+        except (orjson.JSONDecodeError, IOError) as e:
+            logger.error(f"Error reading config file: {e}. Returning default config as a fallback.")
+            return DEFAULT_CONFIG
 
 def save_config(config_data: dict):
     """
     Saves the given dictionary to the app_config.json file.
     """
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config_data, f, indent=4)
-        logger.info(f"Successfully saved new configuration to {CONFIG_FILE}")
-    except IOError as e:
-        logger.error(f"Failed to save configuration file: {e}")
+    with _config_lock:
+        _write_config(config_data)
 
 # --- Initialize the config file on startup ---
 # This ensures the file exists when the application starts.
@@ -1,6 +1,9 @@
+import atexit
 import logging
+import os
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 # --- Configuration ---
 LOG_FILE = "logs/app.log"
@@ -26,27 +29,29 @@ def get_file_handler(log_file: str):
     file_handler.setFormatter(formatter)
     return file_handler
 
+# --- Background logging, configured once on the root logger ---
+# Loggers only push records onto this queue; a single listener thread does the
+# formatting and the console/file I/O, so logging calls never block on disk.
+# Module loggers propagate to the root, so they need no handlers of their own.
+os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+_log_queue = queue.SimpleQueue()
+_listener = QueueListener(_log_queue, get_console_handler(), get_file_handler(LOG_FILE))
+_listener.start()
+# Flush whatever is still queued when the interpreter exits
+atexit.register(_listener.stop)
+
+_root_logger = logging.getLogger()
+_root_logger.setLevel(LOG_LEVEL)
+_root_logger.addHandler(QueueHandler(_log_queue))
+
 def get_logger(logger_name: str):
     """
-    Configures and returns a logger.
-    - It logs to the console.
-    - It logs to a file that rotates daily.
+    Returns a logger for the given name.
+    Records propagate to the root logger, which logs to the console and to a
+    file that rotates daily (both written by a background listener thread).
     """
-    # Get a logger with the specified name
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(LOG_LEVEL)
-    # Prevent log messages from being duplicated in parent loggers
-    logger.propagate = False
-    # Add handlers only if they haven't been added already
-    if not logger.handlers:
-        logger.addHandler(get_console_handler())
-        # Make sure the logs directory exists
-        import os
-        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-        logger.addHandler(get_file_handler(LOG_FILE))
-
-    return logger
+    return logging.getLogger(logger_name)
 
 # --- Create a default logger for easy import ---
 logger = get_logger("ETL_Pipeline")
-logger.info("Logger initialized.")
\ No newline at end of file
+logger.info("Logger initialized.")
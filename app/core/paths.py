@@ -0,0 +1,29 @@
+# app/core/paths.py
+from pathlib import Path
+
+# --- Project paths, resolved once and shared by every module ---
+try:
+    # Path to the top-level project folder
+    PROJECT_ROOT = Path(__file__).resolve().parents[2]
+except NameError:
+    # Fallback for different environments
+    PROJECT_ROOT = Path.cwd()
+
+CONFIG_FILE = PROJECT_ROOT / "app_config.json"
+
+DATABASE_DIR = PROJECT_ROOT / "database"
+DB_PATH = DATABASE_DIR / "data_cache.db"
+TASKS_LOG_FILE = DATABASE_DIR / "tasks_log.jsonl"
+# Whole-file {"tasks": {...}} log used before the JSON Lines format; imported once on startup
+LEGACY_TASKS_LOG_FILE = DATABASE_DIR / "tasks_log.json"
+LATEST_TASK_FILE = DATABASE_DIR / "tasks_latest.json"
+OFFSET_FILE = DATABASE_DIR / "offset.json"
+# Rebuilds keep their own checkpoint, so an incremental run never picks up (or clobbers) one
+REBUILD_OFFSET_FILE = DATABASE_DIR / "offset_rebuild.json"
+
+QUERY_DIR = PROJECT_ROOT / "app" / "query"
+SQL_QUERY_FILE = QUERY_DIR / "fetch_chunk.sql"
+MAX_MODIFIED_SQL_FILE = QUERY_DIR / "max_modified.sql"
+REFRESH_SQL_FILE = QUERY_DIR / "refresh.sql"
+
+EXPORTS_DIR = PROJECT_ROOT / "exports"
@@ -1,66 +1,123 @@
 
+import asyncio
 import uuid
-import time
-from pathlib import Path
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from app.core.logging import get_logger
-from app.services import etl
+from app.core.paths import REFRESH_SQL_FILE
 from app.core.config_manager import get_config, save_config
-# --- Import the mssql service to execute the procedure ---
-from app.db import mssql
 
 logger = get_logger(__name__)
 SCHEDULED_JOB_ID = "full_sync_job" # A unique ID for our scheduled job
+ETL_EXECUTOR = "etl" # Scheduler executor that runs manually triggered full syncs
 
-# --- NEW: Add path to the refresh.sql file ---
-try:
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-    REFRESH_SQL_FILE = PROJECT_ROOT / "app" / "query" / "refresh.sql"
-except NameError:
-    PROJECT_ROOT = Path.cwd()
-    REFRESH_SQL_FILE = PROJECT_ROOT / "app" / "query" / "refresh.sql"
+# --- The refresh command is read once and kept in memory; it doesn't change at runtime ---
+_refresh_command: str | None = None
 
-def scheduled_full_sync_cycle():
+def load_refresh_command() -> str | None:
+    """
+    (Re)reads refresh.sql into the in-memory cache and returns its content.
+    Returns None if the file doesn't exist.
+    """
+    global _refresh_command
+    try:
+        logger.info(f"Loading data refresh command from {REFRESH_SQL_FILE}...")
+        _refresh_command = REFRESH_SQL_FILE.read_text()
+    except FileNotFoundError:
+        logger.error(f"Refresh SQL file not found at {REFRESH_SQL_FILE}.")
+        _refresh_command = None
+    return _refresh_command
+
+# --- Blocking steps of the cycle; these run in worker threads via asyncio.to_thread ---
+# The ETL stack and the SQL Server engine are imported here so they are only
+# initialized when a sync actually runs, not when the app starts (the environment
+# settings they depend on are validated at startup by main.py).
+def _execute_refresh(refresh_command: str) -> bool:
+    from app.db import mssql
+    return mssql.execute_raw_sql(refresh_command)
+
+def _run_full_sync(task_id: str, rebuild: bool = False) -> bool:
+    from app.services import etl
+    return etl.run_full_etl_sync(task_id=task_id, rebuild=rebuild)
+
+# --- Periodic full rescans ---
+# An incremental sync only sees rows whose RegsC modifieddt moved. Edits to columns taken
+# from the joined tables (MInvoice, mstBuyers, SalesOrder, Customers), and rows that join
+# in with an old modifieddt, never move it. So every scheduler.rebuild_every_n_cycles-th
+# cycle re-reads the whole source; the hash-diff upsert still only rewrites changed rows.
+# None until a rebuild completes, so the first cycle after startup (or after a failed
+# rebuild) is always a rebuild.
+_cycles_since_rebuild: int | None = None
+
+def _rebuild_due() -> bool:
+    rebuild_every = max(1, int(get_config().get("scheduler", {}).get("rebuild_every_n_cycles", 1)))
+    return _cycles_since_rebuild is None or _cycles_since_rebuild + 1 >= rebuild_every
+
+async def scheduled_full_sync_cycle():
     logger.info("Scheduler is starting a new full cycle...")
 
     # --- Step 1: Execute the stored procedure from the .sql file ---
     try:
-        logger.info(f"Loading data refresh command from {REFRESH_SQL_FILE}...")
-        refresh_command = REFRESH_SQL_FILE.read_text()
+        refresh_command = _refresh_command
+        if refresh_command is None:
+            logger.error("Refresh SQL file not found at %s. Aborting this sync cycle.", REFRESH_SQL_FILE)
+            return
         
         if not refresh_command.strip():
             logger.warning("The refresh.sql file is empty. Skipping data refresh step.")
         else:
-            logger.info(f"Executing source data refresh procedure: '{refresh_command.strip()}'...")
-            refresh_success = mssql.execute_raw_sql(refresh_command)
+            logger.info("Executing source data refresh procedure: '%s'...", refresh_command.strip())
+            refresh_success = await asyncio.to_thread(_execute_refresh, refresh_command)
             
             if not refresh_success:
                 logger.error("Failed to execute data refresh procedure. Aborting this sync cycle.")
                 # We stop here to prevent syncing potentially stale data
                 return
             
-    except FileNotFoundError:
-        logger.error(f"Refresh SQL file not found at {REFRESH_SQL_FILE}. Aborting this sync cycle.")
-        return
     except Exception as e:
-        logger.critical(f"An unexpected error occurred while trying to refresh data: {e}", exc_info=True)
+        logger.critical("An unexpected error occurred while trying to refresh data: %s", e, exc_info=True)
         return
 
 
     # --- Step 2: Wait for 10 seconds ---
     logger.info("Data refresh procedure executed. Waiting for 10 seconds for changes to propagate...")
-    time.sleep(10)
+    await asyncio.sleep(10)
     
+    global _cycles_since_rebuild
     try:
         task_id = str(uuid.uuid4())
-        etl.run_full_etl_sync(task_id=task_id)
-        logger.info(f"Scheduled FULL sync cycle for task {task_id} has completed successfully.")
+        rebuild = _rebuild_due()
+        completed = await asyncio.to_thread(_run_full_sync, task_id, rebuild)
+        if rebuild and completed:
+            _cycles_since_rebuild = 0
+        elif _cycles_since_rebuild is not None:
+            _cycles_since_rebuild += 1
+        logger.info("Scheduled FULL sync cycle for task %s has completed (rebuild=%s, completed=%s).", task_id, rebuild, completed)
     except Exception as e:
-        logger.critical(f"An unexpected critical error occurred in the scheduled FULL sync cycle: {e}", exc_info=True)
+        logger.critical("An unexpected critical error occurred in the scheduled FULL sync cycle: %s", e, exc_info=True)
+
 
+# Create an instance of the scheduler.
+# The default executor runs the async cycle on the event loop; manual full syncs get a
+# dedicated single-thread pool, so they never occupy the API's workers. Scheduled and
+# manual syncs never overlap: run_full_etl_sync itself serializes every run in the process.
+scheduler = AsyncIOScheduler(executors={
+    "default": AsyncIOExecutor(),
+    ETL_EXECUTOR: ThreadPoolExecutor(max_workers=1),
+})
 
-# Create an instance of the scheduler
-scheduler = AsyncIOScheduler()
+def submit_full_sync(task_id: str, rebuild: bool = False):
+    """Queues a one-off full sync to run right away on the scheduler's ETL executor."""
+    scheduler.add_job(
+        _run_full_sync,
+        kwargs={"task_id": task_id, "rebuild": rebuild},
+        id=task_id,
+        executor=ETL_EXECUTOR,
+        max_instances=1,
+        # A queued sync may wait behind a long-running one; run it however late it starts
+        misfire_grace_time=None
+    )
 
 def reschedule_job(new_interval_minutes: int):
     """Removes the existing job and adds a new one with the updated interval."""
@@ -74,26 +131,40 @@ def reschedule_job(new_interval_minutes: int):
             scheduled_full_sync_cycle,
             trigger='interval',
             minutes=new_interval_minutes,
-            id=SCHEDULED_JOB_ID
+            id=SCHEDULED_JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
         )
         logger.info(f"Successfully rescheduled job '{SCHEDULED_JOB_ID}' to run every {new_interval_minutes} minutes.")
         
+        # get_config() returns the shared cached dict, so save an updated copy instead of editing it
         current_config = get_config()
-        current_config['scheduler']['interval_minutes'] = new_interval_minutes
-        save_config(current_config)
+        save_config({
+            **current_config,
+            "scheduler": {**current_config.get("scheduler", {}), "interval_minutes": new_interval_minutes},
+        })
 
     except Exception as e:
         logger.error(f"Failed to reschedule job: {e}", exc_info=True)
 
 # --- Initial Scheduling on Application Startup ---
+load_refresh_command()
+
 initial_config = get_config()
 initial_interval = initial_config.get("scheduler", {}).get("interval_minutes", 60)
 
-scheduler.add_job(
-    scheduled_full_sync_cycle,
-    trigger='interval',
-    minutes=initial_interval,
-    id=SCHEDULED_JOB_ID
-)
+# Guard against registering the job twice (e.g. if this module is imported again);
+# coalesce collapses missed runs into one and max_instances prevents overlapping cycles
+if not scheduler.get_job(SCHEDULED_JOB_ID):
+    scheduler.add_job(
+        scheduled_full_sync_cycle,
+        trigger='interval',
+        minutes=initial_interval,
+        id=SCHEDULED_JOB_ID,
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
 
 logger.info(f"Scheduler initially configured to run the REFRESH & SYNC cycle every {initial_interval} minutes.")
@@ -1,69 +1,205 @@
 # app/db/mssql.py
-import json
+import os
+import orjson
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from typing import Iterator
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
 from app.core.config import settings
 from app.core.logging import get_logger
 
+# --- Optional dependency: turbodbc reads ODBC result sets straight into column buffers ---
+try:
+    import turbodbc
+except ImportError:
+    turbodbc = None
+
 # Initialize logger for this module
 logger = get_logger(__name__)
 
-try:
-    # Create the SQLAlchemy engine using the URL from our config
-    engine = create_engine(
-        settings.database_url,
-        pool_size=5,
-        pool_pre_ping=True,    # Handles stale connections
-        fast_executemany=True, # Bulk parameters optimization
-        echo=False             # Set to True to log all SQL statements
-    )
-    logger.info("Database engine created successfully.")
-except Exception as e:
-    logger.critical(f"Failed to create database engine: {e}")
+# Number of rows turbodbc buffers per round-trip to the server
+TURBODBC_ROWS_TO_BUFFER = 100_000
 
-def load_last_id(filename: str) -> str | None:
-    """Loads the last processed ID from a JSON file."""
+# Rows pulled from the cursor at a time when building a column-oriented result
+FETCH_PARTITION_SIZE = 2_000
+
+@lru_cache(maxsize=1)
+def get_engine() -> Engine:
+    """
+    Returns the shared SQLAlchemy engine, creating it on first use.
+    Processes that never query SQL Server (e.g. API-only workers) never build the engine or its pool.
+    """
     try:
-        with open(filename, "r") as f:
-            data = json.load(f)
-            last_id = data.get("last_id")
-            logger.info(f"Successfully loaded last_id '{last_id}' from {filename}")
-            return last_id
+        # Create the SQLAlchemy engine using the URL from our config
+        engine = create_engine(
+            settings.database_url,
+            pool_size=10,
+            max_overflow=20,
+            pool_recycle=1800,     # Recycle connections before the server drops them
+            pool_pre_ping=True,    # Handles stale connections
+            fast_executemany=True, # Bulk parameters optimization
+            echo=False             # Set to True to log all SQL statements
+        )
+        logger.info("Database engine created successfully.")
+        return engine
+    except Exception as e:
+        logger.critical(f"Failed to create database engine: {e}")
+        raise
+
+def load_checkpoint(filename: str) -> dict | None:
+    """Loads the whole offset file ({"last_id": ..., plus any extra state}), or None if there is none."""
+    try:
+        with open(filename, "rb") as f:
+            data = orjson.loads(f.read())
+        if not isinstance(data, dict):
+            raise TypeError(f"expected a JSON object, got {type(data).__name__}")
+        return data
     except FileNotFoundError:
-        logger.warning(f"Offset file '{filename}' not found. Will start from the beginning.")
+        logger.info(f"Offset file '{filename}' not found. Will start from the beginning.")
         return None
-    except (json.JSONDecodeError, TypeError) as e:
+    except (orjson.JSONDecodeError, TypeError) as e:
         logger.error(f"Error reading or parsing offset file '{filename}': {e}")
         return None
 
-def save_last_id(last_id: str, filename: str):
-    """Saves the last processed ID to a JSON file."""
+def load_last_id(filename: str) -> str | None:
+    """Loads the last processed ID from a JSON file."""
+    data = load_checkpoint(filename)
+    if data is None:
+        return None
+    last_id = data.get("last_id")
+    logger.info(f"Successfully loaded last_id '{last_id}' from {filename}")
+    return last_id
+
+def save_last_id(last_id: str, filename: str, **state):
+    """
+    Saves the last processed ID to a JSON file, along with any extra state passed as
+    keyword arguments (e.g. what kind of run the ID belongs to).
+    The file is written next to the target and swapped in with os.replace, so a crash
+    mid-write never leaves a truncated offset file behind.
+    """
+    tmp_filename = f"{filename}.tmp"
     try:
-        with open(filename, "w") as f:
-            json.dump({"last_id": last_id}, f, indent=4)
+        with open(tmp_filename, "wb") as f:
+            f.write(orjson.dumps({"last_id": last_id, **state}))
+        os.replace(tmp_filename, filename)
         logger.info(f"Successfully saved last_id '{last_id}' to {filename}")
     except IOError as e:
         logger.error(f"Could not write to offset file '{filename}': {e}")
 
-def fetch_data_as_dict(query: str, params: dict | None = None) -> list[dict] | None:
+def _odbc_value(value: str) -> str:
+    """Quotes a value for an ODBC connection string: wrapped in braces, with '}' doubled."""
+    return "{" + str(value).replace("}", "}}") + "}"
+
+def _connect_turbodbc():
+    """Opens a turbodbc connection that reads result sets in large column buffers."""
+    # Every value is brace-quoted so characters like ';' or '}' in a password can't
+    # break the string or inject extra attributes
+    connection_string = ";".join(f"{key}={_odbc_value(value)}" for key, value in (
+        ("DRIVER", settings.ODBC_DRIVER),
+        ("SERVER", settings.DB_SERVER),
+        ("DATABASE", settings.DB_NAME),
+        ("UID", settings.DB_USER),
+        ("PWD", settings.DB_PASSWORD),
+    ))
+    options = turbodbc.make_options(read_buffer_size=turbodbc.Rows(TURBODBC_ROWS_TO_BUFFER), autocommit=True)
+    return turbodbc.connect(connection_string=connection_string, turbodbc_options=options)
+
+def _fetch_columns_with_turbodbc(conn, query: str, params: dict | None) -> dict[str, list]:
+    """Fetches a query result column-wise through turbodbc's buffered NumPy interface."""
+    # The query uses named :params; compiling it for the pyodbc dialect gives the qmark
+    # SQL that turbodbc expects, plus the order in which to pass the values
+    compiled = text(query).compile(dialect=get_engine().dialect)
+    positional_params = [(params or {})[name] for name in compiled.positiontup]
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(str(compiled), positional_params)
+        # MaskedArray.tolist() turns NULLs into None and numpy scalars into plain Python values
+        return {col: values.tolist() for col, values in cursor.fetchallnumpy().items()}
+
+class SourceSession:
     """
-    Fetches data from the database using a given query and returns a list of dictionaries.
+    Holds a single SQL Server connection open across a series of queries, e.g. every
+    chunk of a full sync, so the connection checkout (or with turbodbc, the full
+    connect and login) is paid once per run instead of once per chunk.
+    The connection is opened on first use in autocommit mode and dropped after a
+    failed query, so the next query starts on a fresh connection.
     """
-    logger.info(f"Executing query to fetch data...")
-    try:
-        with engine.connect() as conn:
+
+    def __init__(self):
+        self._conn = None
+        self._use_turbodbc = False
+
+    def _connection(self):
+        if self._conn is None:
+            self._use_turbodbc = turbodbc is not None and get_engine().dialect.name == "mssql"
+            if self._use_turbodbc:
+                self._conn = _connect_turbodbc()
+            else:
+                self._conn = get_engine().connect().execution_options(isolation_level="AUTOCOMMIT")
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception as e:
+                logger.warning("Error while closing the source connection: %s", e)
+            self._conn = None
+
+    def fetch_data_as_columns(self, query: str, params: dict | None = None) -> dict[str, list] | None:
+        """
+        Fetches data from the database and returns it column-oriented, as {column: [values...]}.
+        Rows are streamed from the cursor in partitions and transposed straight into the
+        column lists (in C, via zip()), so neither a dict per row nor the full list of row
+        objects is ever built.
+        If turbodbc is installed, the result set is read column-wise by the driver instead.
+        Returns None on failure.
+        """
+        logger.info("Executing query to fetch data as columns...")
+        try:
+            conn = self._connection()
+            if self._use_turbodbc:
+                data = _fetch_columns_with_turbodbc(conn, query, params)
+                row_count = len(next(iter(data.values()), []))
+                logger.info("Query executed successfully via turbodbc. Rows fetched: %d", row_count)
+                return data
+            
             result = conn.execute(text(query), params or {})
-            rows = result.fetchall()
-            columns = result.keys()
-            data = [dict(zip(columns, row)) for row in rows]
-            logger.info(f"Query executed successfully. Rows fetched: {len(data)}")
+            data = {col: [] for col in result.keys()}
+            extenders = [values.extend for values in data.values()]
+            row_count = 0
+            for partition in result.partitions(FETCH_PARTITION_SIZE):
+                for extend, values in zip(extenders, zip(*partition)):
+                    extend(values)
+                row_count += len(partition)
+            logger.info("Query executed successfully. Rows fetched: %d", row_count)
             return data
-    except SQLAlchemyError as e:
-        logger.error(f"Database error while fetching data: {e}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"An unexpected error occurred during data fetch: {e}", exc_info=True)
-        return None
+        except SQLAlchemyError as e:
+            logger.error("Database error while fetching data: %s", e, exc_info=True)
+            self.close()
+            return None
+        except Exception as e:
+            logger.error("An unexpected error occurred during data fetch: %s", e, exc_info=True)
+            self.close()
+            return None
+
+@contextmanager
+def session() -> Iterator[SourceSession]:
+    """Provides a SourceSession whose connection is closed when the block exits."""
+    source = SourceSession()
+    try:
+        yield source
+    finally:
+        source.close()
+
+def fetch_data_as_columns(query: str, params: dict | None = None) -> dict[str, list] | None:
+    """
+    Runs a single query on its own connection; see SourceSession.fetch_data_as_columns.
+    Use session() instead when running several queries in a row.
+    """
+    with session() as source:
+        return source.fetch_data_as_columns(query, params)
 
 def execute_raw_sql(sql_command: str) -> bool:
     """
@@ -73,7 +209,7 @@ def execute_raw_sql(sql_command: str) -> bool:
     """
     logger.info(f"Executing raw SQL command: {sql_command}")
     try:
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             # Use a transaction to ensure the command is committed
             with conn.begin() as trans:
                 conn.execute(text(sql_command))
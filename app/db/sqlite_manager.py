@@ -1,41 +1,84 @@
 # app/db/sqlite_manager.py
+import operator
 import sqlite3
-from pathlib import Path
+import threading
 from contextlib import contextmanager
 from app.core.logging import get_logger
+from app.core.paths import DB_PATH
 
 logger = get_logger(__name__)
 
-# --- Configuration ---
-try:
-    # Corrected path calculation to point to the TOP-LEVEL project folder
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-    DB_PATH = PROJECT_ROOT / "database" / "data_cache.db"
-    logger.info(f"Absolute path to SQLite database set to: {DB_PATH}")
-except NameError:
-    DB_PATH = Path("database/data_cache.db")
-    logger.warning(f"Could not determine absolute path. Using relative path: {DB_PATH}")
+logger.info(f"Absolute path to SQLite database set to: {DB_PATH}")
+
+
+# --- Column layout of the cache_data table, in insert order ---
+CACHE_COLUMNS = (
+    "reg_no", "reg_date", "report_release_date", "released", "test_end_date",
+    "invoicing_type", "test_report_stage", "invoice_date", "buyer",
+    "invoice_no", "modifieddt", "hash_value"
+)
+
+# Pulls the column lists out of column-oriented data in CACHE_COLUMNS order in a single C-level call
+_column_values = operator.itemgetter(*CACHE_COLUMNS)
+
+_COLUMN_LIST = ", ".join(CACHE_COLUMNS)
+_PLACEHOLDERS = ", ".join("?" * len(CACHE_COLUMNS))
+
+# Upsert keyed on reg_no; the WHERE on the DO UPDATE turns rows whose hash is
+# unchanged into no-ops, so they are neither rewritten nor counted in rowcount
+UPSERT_SQL = f"""
+    INSERT INTO cache_data ({_COLUMN_LIST}) VALUES ({_PLACEHOLDERS})
+    ON CONFLICT(reg_no) DO UPDATE SET
+        {", ".join(f"{col} = excluded.{col}" for col in CACHE_COLUMNS[1:])}
+    WHERE excluded.hash_value <> cache_data.hash_value
+"""
+
+
+def _open_connection() -> sqlite3.Connection:
+    """Opens the shared SQLite connection and applies the connection-level PRAGMAs once."""
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # isolation_level=None puts the connection in autocommit mode; writers open
+    # their own explicit transactions (see upsert_columns)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-200000")     # ~200 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")    # 256 MB memory-mapped I/O
+    logger.info("Shared SQLite connection opened.")
+    return conn
+
+# --- A single connection is shared by the whole process, serialized by a lock ---
+_conn = _open_connection()
+_conn_lock = threading.Lock()
 
 
 @contextmanager
 def get_connection():
-    """Provides a database connection using a context manager."""
-    db_dir = DB_PATH.parent
-    db_dir.mkdir(parents=True, exist_ok=True)
-    
-    conn = None
+    """Provides exclusive access to the shared database connection using a context manager."""
+    with _conn_lock:
+        try:
+            yield _conn
+        except sqlite3.Error as e:
+            logger.error(f"SQLite connection error: {e}")
+            raise
+
+@contextmanager
+def read_only_connection():
+    """
+    Opens a separate read-only connection for long reads such as the Excel export.
+    In WAL mode it reads a consistent snapshot without taking the shared connection's
+    lock, so upserts and other cache access carry on meanwhile. Closed on exit.
+    """
+    conn = sqlite3.connect(f"file:{DB_PATH.as_posix()}?mode=ro", uri=True, check_same_thread=False)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        logger.debug("SQLite connection opened.")
         yield conn
     except sqlite3.Error as e:
-        logger.error(f"SQLite connection error: {e}")
+        logger.error(f"SQLite read-only connection error: {e}")
         raise
     finally:
-        if conn:
-            conn.close()
-            logger.debug("SQLite connection closed.")
+        conn.close()
 
 def ensure_table_exists():
     """Creates the cache_data table if it doesn't already exist."""
@@ -59,50 +102,67 @@ def ensure_table_exists():
                     hash_value INTEGER NOT NULL
                 )
             """)
+            # Small key/value table for sync bookkeeping such as the modifieddt watermark
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
             conn.commit()
             logger.info("'cache_data' table is ready.")
     except Exception as e:
         logger.error(f"Failed to ensure table exists because of an upstream error: {e}")
 
-def upsert_rows(rows: list[dict]) -> int:
+def upsert_columns(columns: dict[str, list]) -> int:
     """
-    Inserts or updates rows in the SQLite cache.
+    Inserts or updates column-oriented rows ({column: [values]}) in the SQLite cache.
+    The whole chunk goes through one executemany() upsert inside a single transaction,
+    and only new or changed rows (by hash_value) are written.
+    Errors are logged and re-raised, so the caller can stop instead of moving past a
+    chunk that was never stored.
     """
-    if not rows:
+    if not columns or not columns.get('reg_no'):
         logger.info("No rows to upsert into SQLite.")
         return 0
         
     updated_count = 0
     try:
         with get_connection() as conn:
-            cursor = conn.cursor()
-            for row in rows:
-                cursor.execute("SELECT hash_value FROM cache_data WHERE reg_no = ?", (row['reg_no'],))
-                result = cursor.fetchone()
-                
-                if result is None or result['hash_value'] != row['hash_value']:
-                    # --- CORRECTED: Removed 'row_num' from the INSERT OR REPLACE statement ---
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO cache_data (
-                            reg_no, reg_date, report_release_date, released, test_end_date,
-                            invoicing_type, test_report_stage, invoice_date, buyer,
-                            invoice_no, modifieddt, hash_value
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        row['reg_no'], row['reg_date'], row['report_release_date'],
-                        row['released'], row['test_end_date'], row['invoicing_type'],
-                        row['test_report_stage'], row['invoice_date'], row['buyer'],
-                        row['invoice_no'], row['modifieddt'], row['hash_value']
-                    ))
-                    updated_count += 1
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # zip() assembles the row tuples from the column lists in C
+                updated_count = conn.executemany(UPSERT_SQL, zip(*_column_values(columns))).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
             
-            conn.commit()
-            logger.info(f"Upsert complete. Rows affected: {updated_count}")
+            logger.info("Upsert complete. Rows affected: %d", updated_count)
             
     except Exception as e:
-        logger.error(f"An error occurred during SQLite upsert: {e}", exc_info=True)
+        logger.error("An error occurred during SQLite upsert: %s", e, exc_info=True)
+        raise
         
     return updated_count
 
+def get_sync_state(key: str) -> str | None:
+    """Returns the stored sync_state value for key, or None if it was never set."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_sync_state(key: str, value: str | None):
+    """Stores (or clears, with None) a sync_state value."""
+    with get_connection() as conn:
+        if value is None:
+            conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
 # Call this once on application startup
 ensure_table_exists()
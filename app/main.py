@@ -1,16 +1,22 @@
 # main.py
+import asyncio
 import uvicorn
 import uuid
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request
 # --- Add FileResponse to the imports ---
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse
 from contextlib import asynccontextmanager
 from pathlib import Path
 
+# --- Environment settings are validated at startup ---
+# Settings() exits the process when a required variable is missing; importing it here
+# keeps that failure at startup instead of at the first sync. It is cheap to load, unlike
+# the ETL stack and the SQL Server engine, which stay deferred until a sync runs.
+from app.core.config import settings  # noqa: F401
+
 # --- Add these imports for the scheduler and config ---
-from app.core.scheduler import scheduler, reschedule_job
+from app.core.scheduler import scheduler, reschedule_job, load_refresh_command, submit_full_sync
 from app.core.logging import get_logger
-from app.services import etl
 from app.core.config_manager import get_config, save_config
 
 # Updated import to be more direct
@@ -69,10 +75,11 @@ async def get_config_page():
     return FileResponse(html_file_path)
 
 @app.get("/api/v1/config", tags=["Configuration"])
-def get_current_config():
+async def get_current_config():
     """API endpoint to get the current application configuration."""
     logger.info("Fetching current configuration.")
-    return JSONResponse(content=get_config())
+    # get_config() stats (and on change re-reads) the config file, so keep that off the event loop
+    return await asyncio.to_thread(get_config)
 
 @app.post("/api/v1/config", tags=["Configuration"])
 async def update_config(request: Request):
@@ -85,8 +92,10 @@ async def update_config(request: Request):
         
         new_interval = int(new_config_data.get("scheduler", {}).get("interval_minutes", 60))
         reschedule_job(new_interval)
+        # Saving the configuration is also the point where edits to refresh.sql are picked up
+        load_refresh_command()
         
-        return JSONResponse(content={"message": "Configuration updated and scheduler rescheduled successfully."})
+        return {"message": "Configuration updated and scheduler rescheduled successfully."}
         
     except Exception as e:
         logger.error(f"Failed to update configuration: {e}", exc_info=True)
@@ -96,19 +105,24 @@ async def update_config(request: Request):
 # --- Existing Endpoints ---
 
 @app.post("/api/v1/trigger-full-sync", status_code=202, tags=["ETL Full Sync"])
-def trigger_full_sync(background_tasks: BackgroundTasks):
-    """Triggers a continuous ETL sync that runs in a loop until no new data is found."""
-    logger.info("Received request to trigger FULL ETL sync.")
+async def trigger_full_sync(rebuild: bool = False):
+    """
+    Triggers a continuous ETL sync that runs in a loop until no new data is found.
+    The sync runs on the scheduler's ETL executor, not in the API worker.
+    By default only rows modified since the last completed sync are fetched;
+    pass ?rebuild=true to ignore the watermark and re-read the whole source.
+    """
+    logger.info(f"Received request to trigger FULL ETL sync (rebuild={rebuild}).")
     try:
         task_id = str(uuid.uuid4())
-        background_tasks.add_task(etl.run_full_etl_sync, task_id=task_id)
+        submit_full_sync(task_id, rebuild=rebuild)
         return { "message": "Full ETL sync triggered successfully.", "task_id": task_id }
     except Exception as e:
         logger.critical(f"Failed to schedule FULL ETL sync task: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to trigger full ETL sync.")
 
 @app.get("/", tags=["Health Check"])
-def read_root():
+async def read_root():
     """A simple health check endpoint to confirm the API is running."""
     logger.info("Health check endpoint was called.")
     return {"status": "ok", "message": "Welcome to the ETL Pipeline API"}
@@ -1,8 +1,11 @@
 -- fetch_chunk.sql
--- This query now uses named parameters for offset and chunk size
+-- Keyset pagination: each call returns the next :chunk_size rows after :last_id,
+-- so SQL Server seeks straight to the page instead of skipping OFFSET rows.
+-- Also filtered on the modifieddt :watermark for incremental syncs.
 
-SELECT * FROM dbo.vw_ReportStatus_test
+SELECT TOP (:chunk_size) * FROM dbo.vw_ReportStatus_test
 WHERE invoice_date < '2025-05-21'
-ORDER BY {id_column}
-OFFSET :offset ROWS
-FETCH NEXT :chunk_size ROWS ONLY;
\ No newline at end of file
+  -- Incremental sync: only rows changed since the last completed sync
+  AND (modifieddt > :watermark OR modifieddt IS NULL)
+  AND {id_column} > :last_id
+ORDER BY {id_column};
\ No newline at end of file
@@ -0,0 +1,6 @@
+-- max_modified.sql
+-- Highest modifieddt in the source, read before a sync starts scanning.
+-- It becomes the next watermark, so it must use the same filter as fetch_chunk.sql.
+
+SELECT MAX(modifieddt) AS max_modified FROM dbo.vw_ReportStatus_test
+WHERE invoice_date < '2025-05-21';
\ No newline at end of file
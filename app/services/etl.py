@@ -1,28 +1,52 @@
 # app/services/etl.py
 import datetime
-import json
+import operator
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from app.core.logging import get_logger
+from app.core.paths import MAX_MODIFIED_SQL_FILE, OFFSET_FILE, REBUILD_OFFSET_FILE, SQL_QUERY_FILE
 from app.db import mssql, sqlite_manager
 from app.services import hashing
 from app.core.config_manager import get_config
-from app.services import exporter
-
-# --- Configuration ---
-try:
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-    TASKS_LOG_FILE = PROJECT_ROOT / "database" / "tasks_log.json"
-    SQL_QUERY_FILE = PROJECT_ROOT / "app" / "query" / "fetch_chunk.sql"
-except NameError:
-    PROJECT_ROOT = Path.cwd()
-    TASKS_LOG_FILE = PROJECT_ROOT / "database" / "tasks_log.json"
-    SQL_QUERY_FILE = PROJECT_ROOT / "app" / "query" / "fetch_chunk.sql"
+from app.services import exporter, task_log
 
 # --- Define the column to order by for pagination ---
 # This will be inserted into the {id_column} placeholder in your .sql file
 ORDER_BY_COLUMN = "reg_no"
 
+# --- Incremental sync: only source rows modified after this watermark are fetched ---
+WATERMARK_STATE_KEY = "modifieddt_watermark"
+# Used when no sync has completed yet, or for an explicit rebuild
+WATERMARK_FLOOR = datetime.datetime(1900, 1, 1)
+
+# --- Only one full sync runs at a time in this process, whoever triggers it ---
+# Runs share the watermark and the checkpoint files, so a second run waits for the first
+_sync_lock = threading.Lock()
+
+# --- The keyset cursor is checkpointed every PERSIST_EVERY chunks ---
+# so an interrupted sync resumes where it stopped instead of starting over. Incremental
+# syncs use OFFSET_FILE and rebuilds REBUILD_OFFSET_FILE; each checkpoint also records the
+# watermark the run filtered on and the watermark it will advance to, and is only
+# resumed by a run of the same kind filtering on the same watermark.
+PERSIST_EVERY = 10
+
+def _parse_watermark(stored: str | None) -> datetime.datetime | None:
+    if stored is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(stored)
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring unparseable watermark {stored!r}.")
+        return None
+
+def _format_watermark(value) -> str | None:
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, datetime.date) else str(value)
+
 KEY_MAPPING = {
     "reg_no": "reg_no",
     "reg_date": "reg_date",
@@ -36,119 +60,226 @@ KEY_MAPPING = {
     "invoice_no": "invoice_no",
     "modifieddt": "modifieddt"
 }
+
+# Column order used for storage and hashing, fixed once at import; sorting by key
+# keeps the hash independent of the order the source returns its columns in.
+SRC_KEYS_SORTED = sorted(KEY_MAPPING)
+DST_KEYS_SORTED = [KEY_MAPPING[k] for k in SRC_KEYS_SORTED]
+# Pulls the source column lists in SRC_KEYS_SORTED order in a single C-level call
+_source_columns_getter = operator.itemgetter(*SRC_KEYS_SORTED)
+# Every mapped column is required; chunks are checked against this before processing
+_SRC_KEY_SET = frozenset(KEY_MAPPING)
+
 logger = get_logger(__name__)
 
+@lru_cache(maxsize=4)
 def _load_sql_query(filepath: Path) -> str:
+    """Reads a query file once; later pipelines reuse the cached text."""
     if not filepath.is_file():
         logger.error(f"SQL query file not found at: {filepath}")
         raise FileNotFoundError(f"SQL query file not found at: {filepath}")
     logger.info(f"Loading SQL query from: {filepath}")
     return filepath.read_text()
 
-def _process_and_hash_data(data: list[dict]) -> list[dict]:
+def _process_and_hash_data(columns: dict[str, list]) -> dict[str, list]:
     """
-    Processes a chunk of data by remapping keys and calculating a hash.
+    Processes a column-oriented chunk of data by remapping keys and calculating a hash.
+    Hashes for the whole chunk are computed in a single vectorized pass, and the result
+    stays column-oriented ({column: [values]}, plus a 'hash_value' column) all the way to
+    the SQLite upsert, so no per-row dicts are built.
     """
-    processed_data = []
-    for row in data:
-        # Remap the keys of the data intended for storage
-        remapped_row = {KEY_MAPPING.get(k, k): v for k, v in row.items() if k in KEY_MAPPING}
-        
-        # Calculate the hash from the clean, remapped data
-        remapped_row['hash_value'] = hashing.calculate_row_hash(remapped_row)
-        
-        processed_data.append(remapped_row)
+    # Remap the keys of the data intended for storage
+    processed_data = dict(zip(DST_KEYS_SORTED, _source_columns_getter(columns)))
+    
+    # Calculate the hashes from the clean, remapped columns
+    processed_data['hash_value'] = hashing.calculate_column_hashes(processed_data)
         
-    logger.info(f"Processed and hashed {len(processed_data)} rows.")
+    logger.info("Processed and hashed %d rows.", len(processed_data['hash_value']))
     return processed_data
 
-def _update_task_in_log(task_id: str, result: dict):
-    log_data = {}
-    TASKS_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-    if TASKS_LOG_FILE.is_file():
-        with open(TASKS_LOG_FILE, 'r') as f:
-            try: log_data = json.load(f)
-            except json.JSONDecodeError: logger.warning("tasks_log.json is corrupted, starting fresh.")
-    if 'tasks' not in log_data or not isinstance(log_data['tasks'], dict):
-        log_data['tasks'] = {}
-    log_data['tasks'][task_id] = result
-    with open(TASKS_LOG_FILE, 'w') as f:
-        json.dump(log_data, f, indent=4)
-    logger.info(f"Successfully updated status for task {task_id}.")
-
 # This function remains for single-chunk runs if needed
 def run_etl_pipeline(task_id: str):
     pass
 
-def run_full_etl_sync(task_id: str):
+def _load_watermark() -> datetime.datetime:
+    stored = sqlite_manager.get_sync_state(WATERMARK_STATE_KEY)
+    return _parse_watermark(stored) or WATERMARK_FLOOR
+
+def _save_watermark(value):
+    sqlite_manager.set_sync_state(WATERMARK_STATE_KEY, _format_watermark(value))
+
+def run_full_etl_sync(task_id: str, rebuild: bool = False) -> bool:
     """
-    Runs the ETL process in a loop using OFFSET-based pagination.
+    Runs the ETL process in a loop using keyset pagination on ORDER_BY_COLUMN: each
+    chunk starts after the last key of the previous one, so every page is an index seek.
+    Only rows modified since the last completed sync are fetched, unless rebuild is set,
+    in which case the whole source is re-read. The next watermark is the source's
+    MAX(modifieddt) read before the scan starts, and it only advances when the sync runs
+    to completion.
+    The keyset cursor is kept in memory and checkpointed every PERSIST_EVERY stored
+    chunks and when a fetch fails; a later run of the same kind resumes from it.
+    Concurrent calls are serialized: a second sync waits until the running one finishes.
+    Returns True if the sync ran to completion.
     """
+    if not _sync_lock.acquire(blocking=False):
+        logger.info(f"Full sync task {task_id}: another full sync is running; waiting for it to finish.")
+        _sync_lock.acquire()
     overall_start_time = datetime.datetime.now()
-    logger.info(f"Starting FULL ETL sync for task_id: {task_id} using OFFSET pagination...")
+    try:
+        return _full_sync(task_id, rebuild, overall_start_time)
+    except Exception as e:
+        # Whatever went wrong, the task must not be left showing "running"
+        logger.critical(f"Full sync task {task_id} failed: {e}", exc_info=True)
+        task_log.update_task(task_id, {
+            "status": "error",
+            "message": f"Full sync failed: {e}",
+            "start_time": str(overall_start_time),
+            "end_time": str(datetime.datetime.now())
+        })
+        return False
+    finally:
+        _sync_lock.release()
+
+def _full_sync(task_id: str, rebuild: bool, overall_start_time: datetime.datetime) -> bool:
+    logger.info(f"Starting FULL ETL sync for task_id: {task_id} using keyset pagination...")
     
     config = get_config()
     chunk_size = config.get("etl", {}).get("chunk_size", 1000)
+    # Optional pause between chunks, e.g. to throttle load on the source server
+    inter_chunk_sleep_s = config.get("etl", {}).get("inter_chunk_sleep_s", 0)
     logger.info(f"Using chunk size of {chunk_size} from configuration.")
 
-    _update_task_in_log(task_id, {"status": "running", "start_time": str(overall_start_time), "message": "Full sync started."})
+    task_log.update_task(task_id, {"status": "running", "start_time": str(overall_start_time), "message": "Full sync started."})
     
     total_rows_received = 0
     total_rows_updated = 0
-    current_offset = 0
+    chunks_done = 0
+    aborted = False
+
+    watermark = WATERMARK_FLOOR if rebuild else _load_watermark()
+    logger.info(f"Full sync task {task_id}: fetching rows modified after {watermark} (rebuild={rebuild}).")
+
+    # Keyset cursor: the ORDER_BY_COLUMN value of the last row fetched ('' sorts before any reg_no)
+    last_id = ""
+    checkpoint_file = str(REBUILD_OFFSET_FILE if rebuild else OFFSET_FILE)
+    checkpoint = mssql.load_checkpoint(checkpoint_file)
+    # A checkpoint written under a different watermark belongs to a run whose results are
+    # already superseded; start over instead of resuming it
+    if checkpoint and checkpoint.get("last_id") and checkpoint.get("watermark") == _format_watermark(watermark):
+        last_id = checkpoint["last_id"]
+        logger.info(f"Full sync task {task_id}: resuming after {ORDER_BY_COLUMN} {last_id!r}.")
+    resumed = bool(last_id)
     
     try:
         query_template = _load_sql_query(SQL_QUERY_FILE)
         # --- FIX: Format the query to insert the ORDER BY column name ---
         # This is safe because ORDER_BY_COLUMN is a hardcoded variable.
         formatted_query = query_template.format(id_column=ORDER_BY_COLUMN)
-    except FileNotFoundError:
-        result = {"status": "error", "message": f"SQL query file not found at {SQL_QUERY_FILE}"}
-        _update_task_in_log(task_id, result)
-        return
+        max_modified_query = _load_sql_query(MAX_MODIFIED_SQL_FILE)
+    except FileNotFoundError as e:
+        result = {"status": "error", "message": str(e)}
+        task_log.update_task(task_id, result)
+        return False
     except KeyError:
         result = {"status": "error", "message": "The SQL query in fetch_chunk.sql is missing the {id_column} placeholder."}
-        _update_task_in_log(task_id, result)
-        return
+        task_log.update_task(task_id, result)
+        return False
 
-    while True:
-        logger.info(f"Full sync task {task_id}: Fetching chunk with OFFSET {current_offset}.")
-        
-        params = {"offset": current_offset, "chunk_size": chunk_size}
-        source_data = mssql.fetch_data_as_dict(formatted_query, params=params)
+    def _fetch_chunk(source: mssql.SourceSession, after_id: str):
+        logger.info("Full sync task %s: Fetching chunk after %s %r.", task_id, ORDER_BY_COLUMN, after_id)
+        params = {"last_id": after_id, "chunk_size": chunk_size, "watermark": watermark}
+        return source.fetch_data_as_columns(formatted_query, params=params)
 
-        if source_data is None:
-            logger.error(f"Full sync task {task_id}: Failed to fetch data from source. Aborting.")
-            break
-        
-        if not source_data:
-            logger.info(f"Full sync task {task_id}: No more data found. Sync complete.")
-            break
-        
-        rows_in_chunk = len(source_data)
-        total_rows_received += rows_in_chunk
-        
-        processed_data = _process_and_hash_data(source_data)
-        updated_count = sqlite_manager.upsert_rows(processed_data)
-        total_rows_updated += updated_count
-        
-        # Increment the offset for the next loop
-        current_offset += rows_in_chunk
-        
-        logger.info(f"Full sync task {task_id}: Processed chunk of {rows_in_chunk} rows. Total processed: {total_rows_received}.")
-        time.sleep(1)
+    # One SQL Server connection serves every chunk of the run. A single background thread
+    # fetches the next chunk on it while the current one is hashed and upserted; at most
+    # one chunk is prefetched at a time.
+    with mssql.session() as source, ThreadPoolExecutor(max_workers=1, thread_name_prefix="etl-prefetch") as prefetcher:
+        # The next watermark is taken from the source before scanning, not from the rows
+        # seen during the scan: a row behind the keyset cursor can change mid-run with a
+        # modifieddt below that of rows fetched later, and must still be picked up next time
+        if resumed:
+            # The interrupted run's pre-scan value still holds: everything modified up to it
+            # was fetched either before the interruption or is ahead of the cursor now
+            next_watermark = _parse_watermark(checkpoint.get("next_watermark"))
+        else:
+            max_modified_result = prefetcher.submit(source.fetch_data_as_columns, max_modified_query).result()
+            if max_modified_result is None:
+                logger.error("Full sync task %s: Failed to read MAX(modifieddt) from source. Aborting.", task_id)
+                result = {"status": "error", "message": "Failed to read the source watermark."}
+                task_log.update_task(task_id, result)
+                return False
+            next_watermark = next(iter(max_modified_result.values()), [None])[0]
+
+        def _save_checkpoint(stored_id: str):
+            mssql.save_last_id(
+                stored_id, checkpoint_file,
+                watermark=_format_watermark(watermark),
+                next_watermark=_format_watermark(next_watermark),
+            )
+
+        next_chunk = prefetcher.submit(_fetch_chunk, source, last_id)
+
+        while True:
+            source_columns = next_chunk.result()
+
+            if source_columns is None:
+                logger.error("Full sync task %s: Failed to fetch data from source. Aborting.", task_id)
+                aborted = True
+                # Every chunk up to last_id was stored; let the next run pick up from there
+                if last_id:
+                    _save_checkpoint(last_id)
+                break
+            
+            rows_in_chunk = len(next(iter(source_columns.values()), []))
+            
+            if not rows_in_chunk:
+                logger.info("Full sync task %s: No more data found. Sync complete.", task_id)
+                break
+
+            missing_columns = _SRC_KEY_SET.difference(source_columns)
+            if missing_columns:
+                raise ValueError(f"Source query result is missing columns: {', '.join(sorted(missing_columns))}")
+            
+            # Move the keyset cursor past this chunk and start fetching the next one right away
+            last_id = source_columns[ORDER_BY_COLUMN][-1]
+            next_chunk = prefetcher.submit(_fetch_chunk, source, last_id)
+            
+            total_rows_received += rows_in_chunk
+            
+            processed_data = _process_and_hash_data(source_columns)
+            updated_count = sqlite_manager.upsert_columns(processed_data)
+            total_rows_updated += updated_count
+
+            # upsert_columns raises on failure, so reaching this point means the chunk is stored
+            chunks_done += 1
+            if chunks_done % PERSIST_EVERY == 0:
+                _save_checkpoint(last_id)
+            
+            logger.info("Full sync task %s: Processed chunk of %d rows. Total processed: %d.", task_id, rows_in_chunk, total_rows_received)
+            if inter_chunk_sleep_s:
+                time.sleep(inter_chunk_sleep_s)
+
+    if not aborted:
+        # The run reached the end of the source, so the checkpoint is no longer needed
+        Path(checkpoint_file).unlink(missing_ok=True)
+
+    # A partial run must not move the watermark, or the rows it missed would never be fetched
+    if not aborted and next_watermark is not None and (rebuild or next_watermark > watermark):
+        _save_watermark(next_watermark)
+        logger.info(f"Full sync task {task_id}: watermark advanced to {next_watermark}.")
 
     exported_file_path = exporter.export_data_to_excel()
 
     overall_end_time = datetime.datetime.now()
     final_result = {
-        "status": "complete",
-        "message": "Full sync finished.",
+        "status": "error" if aborted else "complete",
+        "message": "Full sync aborted: failed to fetch data from source." if aborted else "Full sync finished.",
         "total_rows_received": total_rows_received,
         "total_rows_updated_in_cache": total_rows_updated,
         "exported_file": exported_file_path,
         "start_time": str(overall_start_time),
         "end_time": str(overall_end_time)
     }
-    _update_task_in_log(task_id, final_result)
+    task_log.update_task(task_id, final_result)
     logger.info(f"Full sync task {task_id} has completed.")
+    return not aborted
@@ -1,31 +1,28 @@
 # app/services/exporter.py
-import datetime
-import pandas as pd
-from pathlib import Path
+import os
+import tempfile
+import xlsxwriter
 from app.core.logging import get_logger
+from app.core.paths import EXPORTS_DIR
 from app.db import sqlite_manager # It needs to connect to the DB
 
 logger = get_logger(__name__)
 
-# --- Configuration for export paths ---
-try:
-    # Calculate path relative to this file's location
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
-    EXPORTS_DIR = PROJECT_ROOT / "exports"
-except NameError:
-    # Fallback for different environments
-    PROJECT_ROOT = Path.cwd()
-    EXPORTS_DIR = PROJECT_ROOT / "exports"
-
 # --- NEW: Define a common, fixed filename for the export ---
 COMMON_EXPORT_FILENAME = "etl_master_export.xlsx"
 
+# Rows pulled from the SQLite cursor per fetchmany() call while streaming the export
+EXPORT_BATCH_SIZE = 10_000
+
 def export_data_to_excel() -> str | None:
     """
     Reads all data from the SQLite cache and exports it to a common Excel file, overwriting it if it already exists.
+    Rows are streamed from the cursor in batches into an xlsxwriter workbook in constant_memory
+    mode, so peak memory is one batch rather than the whole table.
     Returns the path to the exported file on success, otherwise None.
     """
     logger.info(f"Starting export of SQLite data to '{COMMON_EXPORT_FILENAME}'...")
+    tmp_path = None
     try:
         # Ensure the exports directory exists
         EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
@@ -33,25 +30,46 @@ def export_data_to_excel() -> str | None:
         # --- Use the common filename instead of a timestamped one ---
         export_path = EXPORTS_DIR / COMMON_EXPORT_FILENAME
 
-        # Connect to the SQLite database and read data into a pandas DataFrame
-        with sqlite_manager.get_connection() as conn:
-            df = pd.read_sql_query("SELECT * FROM cache_data", conn)
-        
-        if df.empty:
-            logger.warning("SQLite cache is empty. Nothing to export.")
-            # We can optionally delete the old file if no new data exists
-            if export_path.is_file():
-                export_path.unlink()
-                logger.info(f"Deleted old export file at {export_path} as there is no new data.")
-            return None
-            
-        # Save the DataFrame to an Excel file.
-        # The 'to_excel' function will automatically overwrite the existing file.
-        df.to_excel(export_path, index=False, engine='openpyxl')
+        # A separate read-only connection, so the export never holds the shared connection's lock
+        with sqlite_manager.read_only_connection() as conn:
+            # Deterministic row order, so consecutive exports of the same cache are identical
+            cursor = conn.execute("SELECT * FROM cache_data ORDER BY rowid")
+            columns = [description[0] for description in cursor.description]
+            batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+
+            if not batch:
+                logger.warning("SQLite cache is empty. Nothing to export.")
+                # We can optionally delete the old file if no new data exists
+                if export_path.is_file():
+                    export_path.unlink()
+                    logger.info(f"Deleted old export file at {export_path} as there is no new data.")
+                return None
+
+            # Write next to the target and swap it in at the end, so a reader never sees a half-written export
+            fd, tmp_path = tempfile.mkstemp(dir=EXPORTS_DIR, prefix=".export-", suffix=".xlsx")
+            os.close(fd)
+
+            # The with block closes the workbook even if writing fails part-way
+            with xlsxwriter.Workbook(tmp_path, {"constant_memory": True, "strings_to_urls": False}) as workbook:
+                worksheet = workbook.add_worksheet()
+                worksheet.write_row(0, 0, columns)
+
+                row_count = 0
+                while batch:
+                    for row in batch:
+                        row_count += 1
+                        worksheet.write_row(row_count, 0, row)
+                    batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+
+        os.replace(tmp_path, export_path)
+        tmp_path = None
         
-        logger.info(f"Successfully exported and refreshed {len(df)} rows to {export_path}")
+        logger.info(f"Successfully exported and refreshed {row_count} rows to {export_path}")
         return str(export_path)
 
     except Exception as e:
         logger.error(f"Failed to export data to Excel: {e}", exc_info=True)
         return None
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
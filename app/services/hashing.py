@@ -1,34 +1,26 @@
 # app/services/hashing.py
-import zlib
+import pandas as pd
 from app.core.logging import get_logger
 
 # Initialize logger for this module
 logger = get_logger(__name__)
 
-def calculate_row_hash(row: dict) -> int:
+def calculate_column_hashes(columns: dict[str, list]) -> list[int]:
     """
-    Calculates a CRC32 hash for a dictionary row to detect changes.
+    Calculates a hash for every row of column-oriented data in one vectorized pass.
+    Columns are hashed in the order given, so callers must pass them in a fixed
+    order (etl builds them sorted by key once, at import). A row's hash depends only on
+    its own values, never on the rest of the chunk.
     Returns:
-        An integer representing the calculated hash value.
+        A list of signed 64-bit integers (one per row), which fit SQLite's INTEGER type.
     """
-    if not isinstance(row, dict):
-        logger.warning(f"Input to hash function was not a dict, but {type(row)}. Returning 0.")
-        return 0
-        
-    try:
-        # Create a consistent string representation of the dictionary.
-        # - Sort by keys to ensure order doesn't affect the hash.
-        # - Convert all values to strings.
-        concatenated_string = "".join(
-            str(row[key]) for key in sorted(row.keys())
-        )
-        # Encode the string to bytes before hashing
-        encoded_string = concatenated_string.encode('utf-8')
-        # Calculate and return the CRC32 hash
-        hash_value = zlib.crc32(encoded_string)
-        return hash_value
-        
-    except Exception as e:
-        logger.error(f"Could not calculate hash for row: {row}. Error: {e}", exc_info=True)
-        # Return a default/error hash value
-        return 0
+    # Every cell stays the Python value the driver returned: letting pandas infer a dtype
+    # per chunk (datetime64/NaT vs object, int vs float64) would make a row's hash depend
+    # on its neighbours. categorize=False for the same reason, as factorizing re-infers
+    # the dtype of each column's distinct values.
+    df = pd.DataFrame(columns, dtype=object)
+    if df.empty:
+        return []
+    # hash_pandas_object returns uint64; reinterpret the bits as int64 for storage
+    hashes = pd.util.hash_pandas_object(df, index=False, categorize=False)
+    return hashes.to_numpy().view("int64").tolist()
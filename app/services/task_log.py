@@ -0,0 +1,130 @@
+# app/services/task_log.py
+import os
+import tempfile
+import orjson
+from app.core.logging import get_logger
+from app.core.paths import LATEST_TASK_FILE, LEGACY_TASKS_LOG_FILE, TASKS_LOG_FILE
+
+logger = get_logger(__name__)
+
+# TASKS_LOG_FILE is an append-only JSON Lines log: one record per status update.
+# LATEST_TASK_FILE holds only the most recent record, so reading it is constant-time.
+
+# --- In-memory copy of the most recently written task ---
+# Kept fresh by update_task() so status requests don't have to touch disk at all.
+# Held as one (task_id, info) tuple and swapped in a single assignment, so a concurrent
+# reader can never pair a new id with the previous task's info.
+_latest: tuple[str, dict] | None = None
+
+
+def _write_latest(record: bytes):
+    """Atomically replaces the latest-task file so readers never see a partial write."""
+    fd, tmp_path = tempfile.mkstemp(dir=LATEST_TASK_FILE.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(record)
+        os.replace(tmp_path, LATEST_TASK_FILE)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def update_task(task_id: str, result: dict):
+    """Appends the status of a task to the log and refreshes the latest-task file and cache."""
+    TASKS_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    record = orjson.dumps({"task_id": task_id, **result})
+    with open(TASKS_LOG_FILE, 'ab') as f:
+        f.write(record + b"\n")
+    global _latest
+    _write_latest(record)
+    _latest = (task_id, result)
+    logger.info(f"Successfully updated status for task {task_id}.")
+
+
+def peek_latest_task() -> tuple[str, dict] | None:
+    """Returns the in-memory latest task as (task_id, info) without any I/O, or None if it isn't cached."""
+    return _latest
+
+
+def load_tasks() -> dict[str, dict]:
+    """
+    Scans the JSON Lines log and returns {task_id: info} with the last record of each task.
+    Tasks are ordered by their most recent update, so the last key is the latest task.
+    Lines that can't be parsed (e.g. a write cut short by a crash) are skipped.
+    """
+    tasks = {}
+    if not TASKS_LOG_FILE.is_file():
+        return tasks
+    with open(TASKS_LOG_FILE, 'rb') as f:
+        for line_no, line in enumerate(f, start=1):
+            try:
+                info = orjson.loads(line)
+                task_id = info.pop("task_id")
+            except (orjson.JSONDecodeError, KeyError, AttributeError):
+                logger.warning(f"Skipping malformed record on line {line_no} of {TASKS_LOG_FILE}.")
+                continue
+            # Re-insert so the dict order follows the latest update of each task
+            tasks.pop(task_id, None)
+            tasks[task_id] = info
+    return tasks
+
+
+def get_latest_task() -> tuple[str, dict] | None:
+    """
+    Returns the most recently logged task as (task_id, info), or None if no task has been logged.
+    Served from memory; otherwise only the small latest-task file is read. If that file is
+    missing, the full log is scanned instead.
+    Raises orjson.JSONDecodeError if the latest-task file can't be parsed.
+    """
+    global _latest
+    latest = _latest
+    if latest is not None:
+        return latest
+    if LATEST_TASK_FILE.is_file():
+        info = orjson.loads(LATEST_TASK_FILE.read_bytes())
+        latest = (info.pop("task_id"), info)
+    else:
+        tasks = load_tasks()
+        if not tasks:
+            return None
+        latest_task_id = next(reversed(tasks))
+        latest = (latest_task_id, tasks[latest_task_id])
+    # Don't clobber a record written by update_task() while the file was being read
+    if _latest is None:
+        _latest = latest
+    return latest
+
+
+def import_legacy_log():
+    """
+    One-time import of the old whole-file tasks_log.json into the JSON Lines log.
+    Runs only while the JSON Lines log doesn't exist yet, so task history (and the latest
+    status) survives the format change. The old file is left in place untouched.
+    """
+    if TASKS_LOG_FILE.exists() or not LEGACY_TASKS_LOG_FILE.is_file():
+        return
+    try:
+        tasks = orjson.loads(LEGACY_TASKS_LOG_FILE.read_bytes()).get("tasks") or {}
+    except (orjson.JSONDecodeError, AttributeError, OSError) as e:
+        logger.error(f"Could not import legacy task log {LEGACY_TASKS_LOG_FILE}: {e}")
+        return
+    if not tasks:
+        return
+
+    records = [orjson.dumps({"task_id": task_id, **info}) for task_id, info in tasks.items()]
+    # Written to a temp file and swapped in, so a crash can't leave a half-imported log
+    # that would stop the import from ever being retried
+    fd, tmp_path = tempfile.mkstemp(dir=TASKS_LOG_FILE.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b"\n".join(records) + b"\n")
+        os.replace(tmp_path, TASKS_LOG_FILE)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _write_latest(records[-1])
+    logger.info(f"Imported {len(records)} tasks from legacy log {LEGACY_TASKS_LOG_FILE}.")
+
+
+# Call this once on application startup
+import_legacy_log()